@@ -22,4 +22,4 @@ users = {
     settings.GLOBALUSER: settings.GLOBALPASS
 }
 
-from app import routes
\ No newline at end of file
+from app import routes, assets
\ No newline at end of file
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import io
+import os
+
+from flask import request, abort, make_response, url_for
+
+from app import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bokeh files the templates are allowed to load from the local bundle
+BOKEH_ASSETS = ['js/bokeh.min.js', 'js/bokeh-widgets.min.js', 'css/bokeh.min.css', 'css/bokeh-widgets.min.css']
+ASSET_MIMETYPES = {'.js': 'application/javascript', '.css': 'text/css'}
+COMPRESSIBLE_MIMETYPES = ['text/html', 'text/css', 'application/javascript', 'application/json']
+
+# path -> fingerprint of the raw file, cheap enough to fill while rendering a page
+_fingerprints = {}
+# path -> {encoding: body}, filled by precompress_assets() at boot or on first download
+_variants = {}
+_static_dir = []
+
+
+def gzip_bytes(data, level):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return buf.getvalue()
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip_bytes(data, level)
+
+def negotiate_encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def bokeh_static_dir():
+    # Located without importing bokeh, so rendering a page doesn't pull the package in
+    if not _static_dir:
+        try:
+            from importlib.util import find_spec
+            package_dir = os.path.dirname(find_spec('bokeh').origin)
+        except ImportError:
+            import imp
+            package_dir = imp.find_module('bokeh')[1]
+        _static_dir.append(os.path.join(package_dir, 'server', 'static'))
+
+    return _static_dir[0]
+
+def read_asset(path):
+    with open(os.path.join(bokeh_static_dir(), path), 'rb') as f:
+        return f.read()
+
+def asset_fingerprint(path):
+    if path not in _fingerprints:
+        _fingerprints[path] = hashlib.md5(read_asset(path)).hexdigest()[:12]
+
+    return _fingerprints[path]
+
+def asset_variants(path):
+    if path not in _variants:
+        raw = read_asset(path)
+
+        # Static files never change for a given fingerprint, so compress them once at max level
+        variants = {None: raw, 'gzip': gzip_bytes(raw, 9)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(raw, quality=11)
+
+        _variants[path] = variants
+
+    return _variants[path]
+
+def precompress_assets():
+    for path in BOKEH_ASSETS:
+        asset_fingerprint(path)
+        asset_variants(path)
+
+
+# Template helper, e.g. {{ bokeh_asset('js/bokeh.min.js') }}
+@app.context_processor
+def inject_bokeh_asset():
+    def bokeh_asset(path):
+        return url_for('bokeh_static', fingerprint=asset_fingerprint(path), filename=path)
+
+    return dict(bokeh_asset=bokeh_asset)
+
+
+# Fingerprinted Bokeh JS/CSS, no auth so browsers and proxies can share the cached copy
+@app.route('/bokeh-static/<fingerprint>/<path:filename>')
+def bokeh_static(fingerprint, filename):
+
+    if filename not in BOKEH_ASSETS:
+        abort(404)
+
+    current_fingerprint = asset_fingerprint(filename)
+    if fingerprint != current_fingerprint:
+        abort(404)
+
+    encoding = negotiate_encoding()
+    response = make_response(asset_variants(filename)[encoding])
+    response.mimetype = ASSET_MIMETYPES[os.path.splitext(filename)[1]]
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(current_fingerprint + (encoding or ''))
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['BOKEH_ASSET_MAX_AGE']
+    response.headers['Cache-Control'] += ', immutable'
+
+    # Answer revalidations with a 304 rather than the bundle again
+    return response.make_conditional(request)
+
+
+# Compress rendered pages, the inline components() script carries all plot data
+@app.after_request
+def compress_response(response):
+
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    level = app.config['COMPRESS_BR_QUALITY'] if encoding == 'br' else app.config['COMPRESS_LEVEL']
+    response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+
+    return response
@@ -0,0 +1,170 @@
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+
+from app import app
+from app.db import DATA_FILES
+from app.lazy import lazy_import
+from app.plan import Plan
+
+pd = lazy_import('pandas')
+
+# (path, size, mtime) -> content digest, so each data file is only hashed once per process
+_file_digests = {}
+
+# Temporary files older than this were left by a worker that died mid write
+STALE_TMP_SECONDS = 3600
+
+# Step results of the outermost cached call in progress on this thread
+_calls = threading.local()
+
+
+## Keys ##
+
+def file_digest(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key not in _file_digests:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_digests[key] = digest.hexdigest()
+
+    return _file_digests[key]
+
+def value_digest(value):
+    if isinstance(value, Plan):
+        return value.key()
+    # Hashing large frames on every call costs as much as a hit saves, steps read them from upstream steps instead
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        raise TypeError('disk_cached steps take plans and plain values, not frames')
+    return repr(value)
+
+def cache_key(func, version, args, kwargs):
+    digest = hashlib.sha1()
+    # Pickles written by another pandas or Python may not load, or load into different objects
+    parts = [func.__module__, func.__name__, str(version), pd.__version__, '.'.join(map(str, sys.version_info[:3]))]
+    parts += [file_digest(csv) for table, (csv, dates) in sorted(DATA_FILES.items())]
+    parts += [value_digest(arg) for arg in args]
+    parts += [name + '=' + value_digest(kwargs[name]) for name in sorted(kwargs)]
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+## Storage ##
+
+def read_entry(path):
+    with open(path, 'rb') as f:
+        result = pickle.load(f)
+
+    # Bump the access time so eviction drops the least recently used entries first
+    os.utime(path, None)
+    return result
+
+def write_entry(path, result):
+    # Write then rename, so a worker never reads a half written entry
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def evict(cache_dir, max_bytes):
+    entries = []
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+            if name.endswith('.tmp') and now - stat.st_mtime > STALE_TMP_SECONDS:
+                os.remove(path)
+        except OSError:
+            continue
+        if name.endswith('.pkl'):
+            entries.append((stat.st_atime, stat.st_size, path))
+
+    total = sum(size for atime, size, path in entries)
+    for atime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def disk_cached(version, depends=()):
+    """Keep a pipeline step's result on disk, keyed by the data files, the arguments and version.
+
+    Bump version whenever the step's logic changes, old entries are then
+    never read again and age out through eviction. Steps built on other
+    cached steps list them in depends, their keys then include the
+    upstream versions, so bumping one invalidates everything downstream.
+    Within one outermost call each step runs or loads once, also with the
+    cache turned off.
+    """
+    def decorate(func):
+        lineage = repr((version, [step.cache_lineage for step in depends]))
+
+        def cached_call(args, kwargs):
+            cache_dir = app.config['CACHE_DIR']
+            if not cache_dir:
+                return func(*args, **kwargs)
+
+            path = os.path.join(cache_dir, cache_key(func, lineage, args, kwargs) + '.pkl')
+            if os.path.exists(path):
+                # Truncated, corrupt or incompatible entries can fail in many ways, all of them are a miss
+                try:
+                    return read_entry(path)
+                except Exception:
+                    app.logger.warning('Ignoring unreadable cache entry %s', path, exc_info=True)
+
+            result = func(*args, **kwargs)
+
+            # The cache is an optimisation, a full disk or unpicklable result must not fail the request
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                write_entry(path, result)
+                evict(cache_dir, app.config['CACHE_MAX_BYTES'])
+            except Exception:
+                app.logger.warning('Could not write cache entry %s', path, exc_info=True)
+
+            return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Steps that several others build on are loaded or computed once per outermost call, cached or not
+            memo = getattr(_calls, 'memo', None)
+            if memo is None:
+                _calls.memo = {}
+                try:
+                    return wrapper(*args, **kwargs)
+                finally:
+                    _calls.memo = None
+
+            key = (wrapper.cache_lineage, tuple(value_digest(arg) for arg in args),
+                   tuple((name, value_digest(kwargs[name])) for name in sorted(kwargs)))
+            if key not in memo:
+                memo[key] = cached_call(args, kwargs)
+            return memo[key]
+
+        wrapper.cache_lineage = '{0}.{1}{2}'.format(func.__module__, func.__name__, lineage)
+        return wrapper
+
+    return decorate
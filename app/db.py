@@ -0,0 +1,301 @@
+import fcntl
+import os
+import sqlite3
+
+from app.lazy import lazy_import, lazy_from
+
+pd = lazy_import('pandas')
+relativedelta = lazy_from('dateutil.relativedelta', 'relativedelta')
+
+# table name -> (csv file, date columns)
+DATA_FILES = {
+    'applications': ('app/data_files/180301-applications.csv', ['date_created', 'last_modified']),
+    'sitters': ('app/data_files/180301-sitters.csv', ['fst_start_date', 'start_date', 'expires_date']),
+    'assignments': ('app/data_files/180301-assignments.csv', ['created_date', 'start_date', 'end_date']),
+    'owners': ('app/data_files/180301-owners.csv', ['joined_date', 'fst_start_date', 'start_date', 'expires_date', 'published_date']),
+    'standard_verif': ('app/data_files/180313-standard-verif.csv', ['standard_verif']),
+}
+
+INDEXES = [
+    ('applications', 'suser_id'),
+    ('applications', 'assignment_id'),
+    ('applications', 'date_created'),
+    ('sitters', 'user_id'),
+    ('sitters', 'fst_start_date'),
+    ('sitters', 'country_cat'),
+    ('assignments', 'aid'),
+    ('assignments', 'ouser_id'),
+    ('assignments', 'created_date'),
+    ('owners', 'user_id'),
+    ('owners', 'fst_start_date'),
+    ('owners', 'country_cat'),
+    ('standard_verif', 'user_id'),
+]
+
+
+## Building the database ##
+
+def is_stale(path):
+    if not os.path.exists(path):
+        return True
+
+    newest_csv = max(os.path.getmtime(csv) for csv, dates in DATA_FILES.values())
+    return os.path.getmtime(path) < newest_csv
+
+def build_database(path, top_markets, force=False):
+    # Only one process builds at a time, the rest wait and then find the database fresh
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not force and not is_stale(path):
+            return
+
+        # Write to a per-process temporary file and swap it in, so other workers never see a half built database
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            con = sqlite3.connect(tmp_path)
+            try:
+                for table, (csv, dates) in DATA_FILES.items():
+                    data = pd.read_csv(csv, parse_dates=dates)
+                    if 'billing_country' in data.columns:
+                        data['country_cat'] = [x if x in top_markets else 'ROW' for x in data['billing_country']]
+                    data.to_sql(table, con, if_exists='replace', index=False)
+
+                for table, column in INDEXES:
+                    con.execute('CREATE INDEX ix_{0}_{1} ON {0} ({1})'.format(table, column))
+
+                con.commit()
+            finally:
+                con.close()
+
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def connect(path):
+    return sqlite3.connect(path)
+
+
+## Query helpers ##
+
+def report_bounds(report_start, report_end):
+    # Dates are stored as 'YYYY-MM-DD HH:MM:SS' text, the end bound includes the whole of report_end
+    start = pd.Timestamp(report_start)
+    end = pd.Timestamp(report_end) + pd.Timedelta(days=1)
+    return str(start), str(end)
+
+def index_by_month(frame, sum_columns):
+    # Match resample('M'): month end labels, with empty months included
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop('month'), format='%Y-%m') + pd.offsets.MonthEnd(0))
+    if frame.empty:
+        return frame
+
+    frame = frame.reindex(pd.date_range(frame.index.min(), frame.index.max(), freq='M'))
+    frame[sum_columns] = frame[sum_columns].fillna(0)
+
+    return frame
+
+
+### Sitter onboarding queries ###
+
+SITTER_DATA_SQL = """
+WITH report_sitters AS (
+    SELECT user_id, fst_start_date, strftime('%Y-%m', fst_start_date) AS month
+    FROM sitters
+    WHERE fst_start_date >= :start AND fst_start_date < :end
+      AND (:country = 'All' OR country_cat = :country)
+),
+relevant_apps AS (
+    SELECT a.suser_id,
+           COUNT(*) AS nb_applications,
+           SUM(a.oconfirmed = 1 AND a.sconfirmed = 1) AS confirmed_sits
+    FROM applications a
+    JOIN report_sitters s ON s.user_id = a.suser_id
+    WHERE julianday(a.date_created) - julianday(s.fst_start_date) BETWEEN 0 AND 90
+    GROUP BY a.suser_id
+),
+sitter_data AS (
+    SELECT s.user_id, s.fst_start_date, s.month,
+           COALESCE(r.nb_applications, 0) AS nb_applications,
+           COALESCE(r.confirmed_sits, 0) AS confirmed_sits
+    FROM report_sitters s
+    LEFT JOIN relevant_apps r ON r.suser_id = s.user_id
+),
+daily AS (
+    SELECT month,
+           SUM(nb_applications = 0) AS num_inactive,
+           SUM(nb_applications = 0) * 1.0 / COUNT(user_id) AS percent_inactive
+    FROM sitter_data
+    GROUP BY fst_start_date
+)
+"""
+
+SITTER_ONBOARDING_SQL = SITTER_DATA_SQL + """
+SELECT m.month, m.nb_applications, m.confirmed_sits, m.is_successful, m.num_sitters, d.percent_inactive
+FROM (
+    SELECT month,
+           SUM(nb_applications) AS nb_applications,
+           AVG(confirmed_sits) AS confirmed_sits,
+           AVG(confirmed_sits > 0) AS is_successful,
+           COUNT(user_id) AS num_sitters
+    FROM sitter_data
+    GROUP BY month
+) m
+LEFT JOIN (
+    SELECT month, AVG(CASE WHEN num_inactive > 0 THEN percent_inactive END) AS percent_inactive
+    FROM daily
+    GROUP BY month
+) d ON d.month = m.month
+ORDER BY m.month
+"""
+
+SITTER_VERIF_SQL = """
+SELECT strftime('%Y-%m', s.fst_start_date) AS month,
+       AVG(COALESCE(julianday(v.standard_verif) - julianday(s.fst_start_date) <= 30, 0)) AS verif_in_one_month
+FROM sitters s
+LEFT JOIN standard_verif v ON v.user_id = s.user_id
+WHERE s.fst_start_date >= :start AND s.fst_start_date < :end
+  AND (:country = 'All' OR s.country_cat = :country)
+GROUP BY month
+ORDER BY month
+"""
+
+def query_sitter_onboarding(con, country, report_start, report_end):
+    start, end = report_bounds(report_start, report_end)
+    monthly = pd.read_sql_query(SITTER_ONBOARDING_SQL, con, params={'start': start, 'end': end, 'country': country})
+
+    return index_by_month(monthly, ['nb_applications', 'num_sitters'])
+
+def query_sitter_verif(con, country, report_start, report_end):
+    start, end = report_bounds(report_start, report_end)
+    monthly = pd.read_sql_query(SITTER_VERIF_SQL, con, params={'start': start, 'end': end, 'country': country})
+
+    return index_by_month(monthly, [])
+
+
+### Owner onboarding queries ###
+
+OWNER_ONBOARDING_SQL = """
+WITH report_owners AS (
+    SELECT user_id, fst_start_date, strftime('%Y-%m', fst_start_date) AS month
+    FROM owners
+    WHERE fst_start_date >= :start AND fst_start_date < :end
+      AND (:country = 'All' OR country_cat = :country)
+),
+relevant_assignments AS (
+    SELECT o.user_id, o.month,
+           asg.sid IS NOT NULL AS is_assignment_filled,
+           (SELECT COUNT(a.req_type)
+            FROM applications a
+            JOIN sitters s ON s.user_id = a.suser_id
+            WHERE a.assignment_id = asg.aid) AS nb_applications
+    FROM assignments asg
+    JOIN report_owners o ON o.user_id = asg.ouser_id
+    WHERE julianday(asg.created_date) - julianday(o.fst_start_date) BETWEEN 0 AND 90
+),
+owner_totals AS (
+    SELECT user_id,
+           COUNT(*) AS nb_assignments,
+           SUM(is_assignment_filled) AS nb_confirmed_sitters,
+           SUM(nb_applications) AS nb_applications
+    FROM relevant_assignments
+    GROUP BY user_id
+),
+owner_data AS (
+    SELECT o.user_id, o.fst_start_date, o.month,
+           COALESCE(t.nb_assignments, 0) AS nb_assignments,
+           COALESCE(t.nb_confirmed_sitters, 0) AS nb_confirmed_sitters,
+           COALESCE(t.nb_applications * 1.0 / t.nb_assignments, 0) AS nb_apps_per_assignment
+    FROM report_owners o
+    LEFT JOIN owner_totals t ON t.user_id = o.user_id
+),
+daily AS (
+    SELECT month,
+           SUM(nb_assignments = 0) AS num_inactive,
+           SUM(nb_assignments = 0) * 1.0 / COUNT(user_id) AS percent_inactive
+    FROM owner_data
+    GROUP BY fst_start_date
+)
+SELECT m.month, m.nb_assignments, m.nb_apps_per_assignment, m.is_successful,
+       d.percent_inactive, m.nb_owners, c.confirmation_rate
+FROM (
+    SELECT month,
+           SUM(nb_assignments) AS nb_assignments,
+           AVG(CASE WHEN nb_assignments > 0 THEN nb_apps_per_assignment END) AS nb_apps_per_assignment,
+           AVG(nb_confirmed_sitters > 0) AS is_successful,
+           COUNT(user_id) AS nb_owners
+    FROM owner_data
+    GROUP BY month
+) m
+LEFT JOIN (
+    SELECT month, AVG(CASE WHEN num_inactive > 0 THEN percent_inactive END) AS percent_inactive
+    FROM daily
+    GROUP BY month
+) d ON d.month = m.month
+LEFT JOIN (
+    SELECT month, AVG(is_assignment_filled) AS confirmation_rate
+    FROM relevant_assignments
+    GROUP BY month
+) c ON c.month = m.month
+ORDER BY m.month
+"""
+
+def query_owner_onboarding(con, country, report_start, report_end):
+    start, end = report_bounds(report_start, report_end)
+    monthly = pd.read_sql_query(OWNER_ONBOARDING_SQL, con, params={'start': start, 'end': end, 'country': country})
+
+    return index_by_month(monthly, ['nb_assignments', 'nb_owners'])
+
+
+### Network Health queries ###
+
+NH_APPLICATIONS_SQL = """
+SELECT a.suser_id, a.request_id, asg.created_date
+FROM applications a
+JOIN sitters s ON s.user_id = a.suser_id
+JOIN assignments asg ON asg.aid = a.assignment_id
+"""
+
+ROLLING_APPLICATIONS_SQL = """
+SELECT w.period,
+       COUNT(DISTINCT a.suser_id) AS sitters,
+       COUNT(a.request_id) AS applications
+FROM windows w
+LEFT JOIN ({0}) a ON a.created_date >= w.window_start AND a.created_date < w.window_end
+GROUP BY w.period
+ORDER BY w.period
+""".format(NH_APPLICATIONS_SQL)
+
+ROLLING_ASSIGNMENTS_SQL = """
+SELECT w.period,
+       COUNT(DISTINCT asg.ouser_id) AS owners,
+       COUNT(DISTINCT asg.aid) AS assignments,
+       COALESCE(SUM(asg.sid IS NOT NULL), 0) AS filled_assignments,
+       COUNT(DISTINCT CASE WHEN asg.sid IS NOT NULL THEN asg.suser_id END) AS successful_sitters,
+       COUNT(DISTINCT CASE WHEN asg.sid IS NOT NULL THEN asg.ouser_id END) AS successful_owners
+FROM windows w
+LEFT JOIN assignments asg ON asg.created_date >= w.window_start AND asg.created_date < w.window_end
+GROUP BY w.period
+ORDER BY w.period
+"""
+
+def query_rolling_counts(con, report_start):
+    last_date = con.execute('SELECT MAX(created_date) FROM ({0})'.format(NH_APPLICATIONS_SQL)).fetchone()[0]
+    date_index = pd.date_range(report_start, last_date, freq='1M')-pd.offsets.MonthEnd(1)
+
+    # Trailing twelve month window ending on each month end
+    windows = [(str(day), str(day - relativedelta(months=12)), str(day + pd.Timedelta(days=1))) for day in date_index]
+    con.execute('CREATE TEMP TABLE windows (period TEXT, window_start TEXT, window_end TEXT)')
+    con.executemany('INSERT INTO windows VALUES (?, ?, ?)', windows)
+
+    apps_counts = pd.read_sql_query(ROLLING_APPLICATIONS_SQL, con, index_col='period')
+    assg_counts = pd.read_sql_query(ROLLING_ASSIGNMENTS_SQL, con, index_col='period')
+
+    con.execute('DROP TABLE windows')
+
+    df = pd.concat([assg_counts, apps_counts], axis=1)
+    df.index = date_index
+
+    return df
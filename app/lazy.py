@@ -0,0 +1,59 @@
+import importlib
+
+# Every module name handed out below, so preload() can import them up front
+_lazy_modules = set()
+
+
+class LazyModule(object):
+    """Stand-in for `import module`, the real import happens on first attribute access."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        _lazy_modules.add(name)
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+class LazyAttribute(object):
+    """Stand-in for `from module import name`, resolved the first time it is called or indexed."""
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._target = None
+        _lazy_modules.add(module)
+
+    def _load(self):
+        if self._target is None:
+            self._target = getattr(importlib.import_module(self._module), self._name)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+def lazy_from(module, name):
+    return LazyAttribute(module, name)
+
+def preload():
+    # Used by a forking server master, so workers start with everything already imported
+    for name in sorted(_lazy_modules):
+        importlib.import_module(name)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from bokeh.layouts import column
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import Select, Div, Panel, Tabs
+from bokeh.util.serialization import convert_datetime_array
+
+from app import app
+from app.routes import (COUNTRY_OPTIONS, data_version, manipulate_numactive, create_growth_source, visualise_growth,
+                        generate_counts_html, load_rolling, create_rolling_data_source, visualise)
+
+# Series shared by every session on this server, keyed by (name, country)
+_series = {}
+_series_version = [None]
+
+
+## Shared data ##
+
+def get_series(name, loader, country):
+    # Drop everything once the data files have been replaced
+    version = data_version()
+    if version != _series_version[0]:
+        _series.clear()
+        _series_version[0] = version
+
+    key = (name, country)
+    if key not in _series:
+        _series[key] = loader(country)
+
+    return _series[key]
+
+def growth_data(country):
+    return create_growth_source(get_series('growth', manipulate_numactive, country))
+
+def rolling_data(country):
+    return create_rolling_data_source(get_series('rolling', load_rolling, country))
+
+def as_array(values):
+    # stream() converts new dates to epoch milliseconds, so the stored column must already hold them
+    values = np.array(values)
+    if values.dtype.kind == 'M':
+        values = convert_datetime_array(values)
+    return values
+
+def as_arrays(data):
+    # Copies, so the arrays are writable for patch() and don't share memory with the cached series
+    return dict((name, as_array(values)) for name, values in data.items())
+
+
+## Incremental updates ##
+
+def changed_rows(old, new):
+    # NaN counts as unchanged, so ratio columns with gaps aren't re-sent on every refresh
+    old, new = np.asarray(old), np.asarray(new)
+    same = (old == new) | (pd.isnull(old) & pd.isnull(new))
+    return np.flatnonzero(~same)
+
+def update_source(source, data):
+    # Patch the months already plotted and stream any new ones, so browsers never reload the document
+    data = as_arrays(data)
+    length = len(source.data['x'])
+    new_length = len(data['x'])
+
+    if new_length < length:
+        source.data = data
+        return
+
+    patches = {}
+    for name, values in data.items():
+        rows = changed_rows(source.data[name], values[:length])
+        if len(rows):
+            changed = slice(rows[0], rows[-1] + 1)
+            patches[name] = [(changed, values[changed])]
+    if patches:
+        source.patch(patches)
+
+    if new_length > length:
+        source.stream(dict((name, values[length:]) for name, values in data.items()))
+
+
+## Document ##
+
+def build_document(doc):
+    country = Select(title="Filter by country:", value="All", options=COUNTRY_OPTIONS)
+
+    # Membership growth
+    growth = growth_data(country.value)
+    growth_source = ColumnDataSource(data=as_arrays(growth))
+    counts = Div(text=generate_counts_html(ColumnDataSource(data=growth)), width=200, height=100)
+    growth_layout = column(country, visualise_growth(growth_source), counts, width=1200)
+
+    # Network health, rolling 12 months
+    rolling_source = ColumnDataSource(data=as_arrays(rolling_data(country.value)))
+    nh_plots = visualise(rolling_source,
+        ['sitter_success', 'sits_per_sitter', 'owner_success', 'confirmation_rate', 'member_ratio'],
+        ['Active Sitter Success', 'Sits Per Active Sitter', 'Active Owner Success', 'Confirmation Rate', 'Active Member Ratio'],
+        ['Success rate', 'Sits', 'Success rate', 'Confirmation rate', 'Ratio'],
+        ['{0%}', '{0.00}', '{0%}', '{0%}', '{0.00}'],
+        [True, False, True, True, False])
+    nh_layout = column(nh_plots)
+
+    def refresh_growth():
+        growth = growth_data(country.value)
+        update_source(growth_source, growth)
+        counts.text = generate_counts_html(ColumnDataSource(data=growth))
+
+    def refresh():
+        refresh_growth()
+        update_source(rolling_source, rolling_data(country.value))
+
+    country.on_change('value', lambda attr, old, new: refresh_growth())
+
+    doc.add_root(Tabs(tabs=[
+        Panel(child=growth_layout, title='Membership Growth'),
+        Panel(child=nh_layout, title='Network Health')]))
+    doc.title = 'Network Health Dashboard'
+    doc.add_periodic_callback(refresh, app.config['LIVE_REFRESH_SECONDS'] * 1000)
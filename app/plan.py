@@ -0,0 +1,58 @@
+from app.db import DATA_FILES
+from app.lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+
+class Plan(object):
+    """Columns and date windows a pipeline needs from each data file.
+
+    Nothing is loaded while the plan is built. read() then loads only the
+    selected columns and drops rows outside the window, before the frame
+    reaches any merge. Tables with nothing recorded are read in full.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.windows = {}
+
+    def select(self, table, columns):
+        self.columns.setdefault(table, set()).update(columns)
+        return self
+
+    def between(self, table, column, start=None, end=None, pad_days=0):
+        # Same rows as .loc[start:end] on a date index, end includes the whole day
+        if start is not None:
+            start = pd.Timestamp(start)
+        if end is not None:
+            end = pd.Timestamp(end) + pd.Timedelta(days=1 + pad_days)
+
+        self.windows[table] = (column, start, end)
+        return self
+
+    def key(self):
+        # Stable description of the plan, used in disk cache keys
+        columns = sorted((table, sorted(columns)) for table, columns in self.columns.items())
+        windows = sorted((table, column, str(start), str(end)) for table, (column, start, end) in self.windows.items())
+        return repr((columns, windows))
+
+    def read(self, table):
+        csv, dates = DATA_FILES[table]
+
+        usecols = None
+        if table in self.columns:
+            usecols = sorted(self.columns[table])
+            dates = [d for d in dates if d in self.columns[table]]
+
+        data = pd.read_csv(csv, usecols=usecols, parse_dates=dates)
+
+        if table in self.windows:
+            column, start, end = self.windows[table]
+            keep = data[column].notnull()
+            if start is not None:
+                keep &= data[column] >= start
+            if end is not None:
+                keep &= data[column] < end
+            data = data[keep]
+
+        return data
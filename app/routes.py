@@ -1,20 +1,28 @@
-from flask import render_template, flash, redirect, url_for, request
-from app import app, auth
+from flask import render_template, request
+from app import app, auth, db, assets
+from app.lazy import lazy_import, lazy_from, preload
+from app.plan import Plan
+from app.cache import disk_cached
 
-import numpy as np
-import pandas as pd
 import datetime
-import calendar
-from time import strftime
-from dateutil.relativedelta import relativedelta
-
-from bokeh.io import curdoc
-from bokeh.plotting import figure, show
-from bokeh.layouts import row, column, widgetbox, gridplot
-from bokeh.models import ColumnDataSource, DatetimeTickFormatter, NumeralTickFormatter, HoverTool
-from bokeh.palettes import brewer
-from bokeh.models.widgets import Select, Div, Panel
-from bokeh.embed import components
+import functools
+import glob
+import os
+
+# Analytics and plotting libraries are only imported by the first route that needs them
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+relativedelta = lazy_from('dateutil.relativedelta', 'relativedelta')
+
+figure = lazy_from('bokeh.plotting', 'figure')
+row = lazy_from('bokeh.layouts', 'row')
+column = lazy_from('bokeh.layouts', 'column')
+ColumnDataSource = lazy_from('bokeh.models', 'ColumnDataSource')
+NumeralTickFormatter = lazy_from('bokeh.models', 'NumeralTickFormatter')
+HoverTool = lazy_from('bokeh.models', 'HoverTool')
+brewer = lazy_from('bokeh.palettes', 'brewer')
+Div = lazy_from('bokeh.models.widgets', 'Div')
+components = lazy_from('bokeh.embed', 'components')
 
 # Global settings
 TOOLS = "pan,wheel_zoom,box_zoom,reset"
@@ -23,7 +31,29 @@ REPORT_END = '30-Nov-2017' # End point for onboarding reports, usually 3 months
 TOP_MARKETS = ['United Kingdom','United States', 'Australia', 'Canada', 'New Zealand']
 COUNTRY_OPTIONS = ["All", "United Kingdom", "United States", "Australia", "Canada", "New Zealand", "ROW"]
 
+# Series computed at boot by warm_up(), keyed by (loader name, country) -> (data version, series)
+PRECOMPUTED = {}
+
+def data_version():
+    # Changes whenever any of the data files is replaced
+    return tuple(sorted((path, os.path.getmtime(path)) for path in glob.glob('app/data_files/*.csv')))
+
+def precomputed(loader):
+    @functools.wraps(loader)
+    def wrapper(country):
+        key = (loader.__name__, country)
+        if key in PRECOMPUTED:
+            version, series = PRECOMPUTED[key]
+            if version == data_version():
+                return series
+            del PRECOMPUTED[key]
+        return loader(country)
+
+    wrapper.compute = loader
+    return wrapper
+
 ## Growth data manipulation ##
+@precomputed
 def manipulate_numactive(country):
     member_numbers = pd.read_csv('app/data_files/180301-num-active.csv', parse_dates=(['period']))
     member_numbers = (member_numbers.groupby(['period', 'country', 'membership_type'])['num_active']
@@ -93,9 +123,10 @@ def generate_counts_html(source):
 
 ### Sitter success data manipulation ###
 
-def manipulate_sitters_apps(country):
-    apps = pd.read_csv('app/data_files/180301-applications.csv', parse_dates=['date_created', 'last_modified'])
-    sitters = pd.read_csv('app/data_files/180301-sitters.csv', parse_dates=['fst_start_date', 'start_date', 'expires_date'])
+def manipulate_sitters_apps(country, plan=None):
+    plan = plan or Plan()
+    apps = plan.read('applications')
+    sitters = plan.read('sitters')
 
     apps = pd.merge(
         apps,
@@ -133,25 +164,29 @@ def manipulate_sitters_apps(country):
     else:
         return apps, sitter_data[sitter_data.country_cat == country]
 
-def manipulate_sitter_verif(sitter_data):
-    st_verif = pd.read_csv('app/data_files/180313-standard-verif.csv', parse_dates=['standard_verif'])
+def manipulate_sitter_verif(sitter_data, plan=None):
+    plan = plan or Plan()
+    st_verif = plan.read('standard_verif')
     sitter_verif = sitter_data.reset_index().merge(st_verif, how='left', on='user_id')
 
     sitter_verif['verif_in_one_month'] = (sitter_verif.standard_verif - sitter_verif.fst_start_date) <= datetime.timedelta(days=30)
 
     return sitter_verif
 
-def create_sitter_verif_source(data):
-    sampled_sitters = data.set_index('fst_start_date').loc[REPORT_START:REPORT_END].verif_in_one_month.resample('M').mean()
+def sample_sitter_verif(data):
+    sampled_sitters = data.set_index('fst_start_date').loc[REPORT_START:REPORT_END][['verif_in_one_month']].resample('M').mean()
 
+    return sampled_sitters
+
+def create_sitter_verif_source(data):
     source = dict(
-        x=sampled_sitters.index,
-        y=sampled_sitters,
-        datestr=[d.strftime("%d-%m-%Y") for d in sampled_sitters.index])
+        x=data.index,
+        y=data.verif_in_one_month,
+        datestr=[d.strftime("%d-%m-%Y") for d in data.index])
 
     return source
 
-def create_sitter_onboarding_source(data):
+def sample_sitter_onboarding(data):
 
     sampled_sitters = data.loc[REPORT_START:REPORT_END].resample('M').agg({
         'nb_applications': np.sum,
@@ -170,28 +205,32 @@ def create_sitter_onboarding_source(data):
     'num_sitters': np.sum,
     'percent_inactive': np.mean})
 
+    return pd.concat([sampled_sitters, sampled_activity], axis=1)
+
+def create_sitter_onboarding_source(data):
     source = dict(
-        x=sampled_sitters.index,
-        nb_applications=sampled_sitters.nb_applications,
-        confirmed_sits=sampled_sitters.confirmed_sits,
-        is_successful=sampled_sitters.is_successful,
-        percent_inactive=sampled_activity.percent_inactive,
-        num_sitters=sampled_activity.num_sitters,
-        datestr=[d.strftime("%d-%m-%Y") for d in sampled_sitters.index])
+        x=data.index,
+        nb_applications=data.nb_applications,
+        confirmed_sits=data.confirmed_sits,
+        is_successful=data.is_successful,
+        percent_inactive=data.percent_inactive,
+        num_sitters=data.num_sitters,
+        datestr=[d.strftime("%d-%m-%Y") for d in data.index])
 
     return source
 
 ### Owner success data manipulation ###
 
-def manipulate_owner_assignments(apps, country):
-    asgnmts = pd.read_csv('app/data_files/180301-assignments.csv', parse_dates=['created_date', 'start_date', 'end_date'])
+def manipulate_owner_assignments(apps, country, plan=None):
+    plan = plan or Plan()
+    asgnmts = plan.read('assignments')
     asgnmts['is_assignment_filled'] = asgnmts.sid.notnull()
 
     app_count = apps.groupby('assignment_id')['req_type'].count()
     asgnmts.set_index('aid', inplace=True)
     asgnmts['nb_applications'] = app_count
 
-    owners = pd.read_csv('app/data_files/180301-owners.csv', parse_dates=['joined_date', 'fst_start_date', 'start_date', 'expires_date', 'published_date'])
+    owners = plan.read('owners')
     assignments_impr = pd.merge(asgnmts,
                                 owners[['user_id','billing_country', 'fst_start_date']],
                                 left_on='ouser_id', right_on='user_id')
@@ -226,14 +265,14 @@ def manipulate_owner_assignments(apps, country):
         return asgnmts, relevant_assignments[relevant_assignments.country_cat == country], owners[owners.country_cat == country]
 
 
-def create_owner_onboarding_source(owner_data, assignment_data):
+def sample_owner_onboarding(owner_data, assignment_data):
 
     sampled_owners = owner_data.loc[REPORT_START:REPORT_END].resample('M').agg({
         'nb_assignments': np.sum,
         'is_successful': np.mean
         }
     )
-    sampled_active_owners = owner_data[owner_data.nb_assignments > 0].loc[REPORT_START:REPORT_END].resample('M').mean()
+    sampled_active_owners = owner_data[owner_data.nb_assignments > 0].loc[REPORT_START:REPORT_END][['nb_apps_per_assignment']].resample('M').mean()
 
     num_owners = owner_data.groupby('fst_start_date')['user_id'].count()
     num_owners_inactive = owner_data[owner_data.nb_assignments == 0].groupby('fst_start_date')['user_id'].count()
@@ -246,17 +285,25 @@ def create_owner_onboarding_source(owner_data, assignment_data):
         'percent_inactive': np.mean
         }
     )
-    sampled_assignments = assignment_data.set_index('fst_start_date').loc[REPORT_START:REPORT_END].resample('M').mean()
+    sampled_assignments = assignment_data.set_index('fst_start_date').loc[REPORT_START:REPORT_END][['is_assignment_filled']].resample('M').mean()
 
+    return pd.concat([
+        sampled_owners,
+        sampled_active_owners.nb_apps_per_assignment,
+        sampled_activity.percent_inactive,
+        sampled_activity.num_owners.rename('nb_owners'),
+        sampled_assignments.is_assignment_filled.rename('confirmation_rate')], axis=1)
+
+def create_owner_onboarding_source(data):
     source = dict(
-        x=sampled_owners.index,
-        nb_assignments=sampled_owners.nb_assignments,
-        nb_apps_per_assignment=sampled_active_owners.nb_apps_per_assignment,
-        is_successful=sampled_owners.is_successful,
-        percent_inactive=sampled_activity.percent_inactive,
-        nb_owners=sampled_activity.num_owners,
-        confirmation_rate=sampled_assignments.is_assignment_filled,
-        datestr=[d.strftime("%d-%m-%Y") for d in sampled_owners.index])
+        x=data.index,
+        nb_assignments=data.nb_assignments,
+        nb_apps_per_assignment=data.nb_apps_per_assignment,
+        is_successful=data.is_successful,
+        percent_inactive=data.percent_inactive,
+        nb_owners=data.nb_owners,
+        confirmation_rate=data.confirmation_rate,
+        datestr=[d.strftime("%d-%m-%Y") for d in data.index])
 
     return source
 
@@ -308,6 +355,9 @@ def calculate_rolling(apps_data, assgs_data, date_index):
     
     df = pd.DataFrame(data=values, index=date_index)
 
+    return add_rolling_ratios(df)
+
+def add_rolling_ratios(df):
     # broadcast new calculated columns
     df['assignments_per_owner'] = df.assignments / df.owners
     df['apps_per_assignment'] = df.applications / df.assignments
@@ -333,6 +383,150 @@ def create_rolling_data_source(data):
 
     return source
 
+### Data loading, pandas or embedded SQLite backend ###
+
+def get_db():
+    path = app.config['DATABASE_PATH']
+    if db.is_stale(path):
+        db.build_database(path, TOP_MARKETS)
+
+    return db.connect(path)
+
+@app.cli.command('build-db')
+def build_db_command():
+    """Load the data_files CSVs into the embedded SQLite database."""
+    db.build_database(app.config['DATABASE_PATH'], TOP_MARKETS, force=True)
+
+### Query plans, the columns and date windows each pandas pipeline reads ###
+
+SITTER_COLUMNS = ['user_id', 'fst_start_date', 'billing_country']
+APP_COLUMNS = ['suser_id', 'date_created', 'oconfirmed', 'sconfirmed']
+ASSIGNMENT_COLUMNS = ['aid', 'sid', 'ouser_id', 'created_date']
+OWNER_COLUMNS = ['user_id', 'billing_country', 'fst_start_date']
+
+def sitter_onboarding_plan():
+    # Only sitters starting in the report, and their applications from the following 90 days
+    return (Plan()
+        .select('sitters', SITTER_COLUMNS)
+        .between('sitters', 'fst_start_date', REPORT_START, REPORT_END)
+        .select('applications', APP_COLUMNS)
+        .between('applications', 'date_created', REPORT_START, REPORT_END, pad_days=90)
+        .select('standard_verif', ['user_id', 'standard_verif']))
+
+def owner_onboarding_plan():
+    # Applications are counted per assignment from every sitter, so only owners and assignments are windowed
+    return (Plan()
+        .select('sitters', SITTER_COLUMNS)
+        .select('applications', APP_COLUMNS + ['assignment_id', 'req_type'])
+        .select('assignments', ASSIGNMENT_COLUMNS)
+        .between('assignments', 'created_date', REPORT_START, REPORT_END, pad_days=90)
+        .select('owners', OWNER_COLUMNS)
+        .between('owners', 'fst_start_date', REPORT_START, REPORT_END))
+
+def rolling_plan():
+    # Assignments created before the first trailing 12 month window are never counted
+    first_month = pd.date_range(REPORT_START, periods=1, freq='M')[0] - pd.offsets.MonthEnd(1)
+    return (Plan()
+        .select('sitters', SITTER_COLUMNS)
+        .select('applications', APP_COLUMNS + ['assignment_id', 'req_type', 'request_id'])
+        .select('assignments', ASSIGNMENT_COLUMNS + ['suser_id'])
+        .between('assignments', 'created_date', start=first_month - relativedelta(months=12))
+        .select('owners', OWNER_COLUMNS))
+
+### Cached pipeline steps, keyed by their plan, country filters are applied to their results ###
+
+@disk_cached(version=1)
+def sitters_apps_step(plan):
+    return manipulate_sitters_apps("All", plan)
+
+@disk_cached(version=1, depends=[sitters_apps_step])
+def onboarding_sitters_step(plan):
+    # Its own entry, so per country requests don't unpickle the merged applications only to drop them
+    apps, sitter_data = sitters_apps_step(plan)
+    return sitter_data
+
+@disk_cached(version=1, depends=[onboarding_sitters_step])
+def sitter_verif_step(plan):
+    return manipulate_sitter_verif(onboarding_sitters_step(plan), plan)
+
+@disk_cached(version=1, depends=[sitters_apps_step])
+def owner_assignments_step(plan):
+    apps, sitter_data = sitters_apps_step(plan)
+    return manipulate_owner_assignments(apps, "All", plan)
+
+@disk_cached(version=1, depends=[owner_assignments_step])
+def owner_onboarding_step(plan):
+    # Likewise without the assignments frame
+    asgnmts, relevant_assignments, owners = owner_assignments_step(plan)
+    return relevant_assignments, owners
+
+@disk_cached(version=1, depends=[sitters_apps_step, owner_assignments_step])
+def rolling_step(plan):
+    # The network health figures cover every country, so there is one entry per plan
+    apps, sitter_data = sitters_apps_step(plan)
+    asgnmts, relevant_assignments, owners = owner_assignments_step(plan)
+    nh_applications, nh_assignments, nh_index = manipulate_full_data(asgnmts, apps)
+    return calculate_rolling(nh_applications, nh_assignments, nh_index)
+
+def filter_country(data, country):
+    if (country == "All"):
+        return data
+    return data[data.country_cat == country]
+
+@precomputed
+def load_sitter_onboarding(country):
+    if app.config['DATA_BACKEND'] == 'sqlite':
+        con = get_db()
+        try:
+            return db.query_sitter_onboarding(con, country, REPORT_START, REPORT_END)
+        finally:
+            con.close()
+
+    return sample_sitter_onboarding(filter_country(onboarding_sitters_step(sitter_onboarding_plan()), country))
+
+@precomputed
+def load_sitter_verif(country):
+    if app.config['DATA_BACKEND'] == 'sqlite':
+        con = get_db()
+        try:
+            return db.query_sitter_verif(con, country, REPORT_START, REPORT_END)
+        finally:
+            con.close()
+
+    return sample_sitter_verif(filter_country(sitter_verif_step(sitter_onboarding_plan()), country))
+
+@precomputed
+def load_owner_onboarding(country):
+    if app.config['DATA_BACKEND'] == 'sqlite':
+        con = get_db()
+        try:
+            return db.query_owner_onboarding(con, country, REPORT_START, REPORT_END)
+        finally:
+            con.close()
+
+    relevant_assignments, owners = owner_onboarding_step(owner_onboarding_plan())
+    return sample_owner_onboarding(filter_country(owners, country), filter_country(relevant_assignments, country))
+
+@precomputed
+def load_rolling(country):
+    if app.config['DATA_BACKEND'] == 'sqlite':
+        con = get_db()
+        try:
+            return add_rolling_ratios(db.query_rolling_counts(con, REPORT_START))
+        finally:
+            con.close()
+
+    return rolling_step(rolling_plan())
+
+def warm_up(countries):
+    # Import the analytics stack, compress the Bokeh bundle and load the default series before any request arrives
+    preload()
+    assets.precompress_assets()
+    version = data_version()
+    for loader in [manipulate_numactive, load_sitter_onboarding, load_sitter_verif, load_owner_onboarding, load_rolling]:
+        for country in countries:
+            PRECOMPUTED[(loader.__name__, country)] = (version, loader.compute(country))
+
 def visualise(source, field_list, title_list, axis_list, format_list, percent_list):
 
     plots = [] # new list for all plots
@@ -442,7 +636,7 @@ def new_sitter_success():
         current_country = "All"
 
     # Create sitter onboarding datasource and plots
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
+    onboarding_sitters = load_sitter_onboarding(current_country)
     sitter_onboarding_source = ColumnDataSource(data=create_sitter_onboarding_source(onboarding_sitters))
     
     var_list = ['is_successful', 'confirmed_sits']
@@ -475,7 +669,7 @@ def new_sitter_activity():
         current_country = "All"
 
     # Create sitter onboarding datasource and plots
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
+    onboarding_sitters = load_sitter_onboarding(current_country)
     sitter_onboarding_source = ColumnDataSource(data=create_sitter_onboarding_source(onboarding_sitters))
     
     var_list = ['nb_applications', 'percent_inactive']
@@ -508,7 +702,7 @@ def new_sitter_volume():
         current_country = "All"
 
     # Create sitter onboarding datasource and plots
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
+    onboarding_sitters = load_sitter_onboarding(current_country)
     sitter_onboarding_source = ColumnDataSource(data=create_sitter_onboarding_source(onboarding_sitters))
     
     var_list = ['num_sitters']
@@ -541,8 +735,7 @@ def new_sitter_verif():
         current_country = "All"
 
     # Create sitter onboarding datasource and plots
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-    sitters_with_verif = manipulate_sitter_verif(onboarding_sitters)
+    sitters_with_verif = load_sitter_verif(current_country)
     sitter_verif_source = create_sitter_verif_source(sitters_with_verif)
 
     var_list = ['y']
@@ -573,12 +766,9 @@ def new_owner_success():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
     # Create owner onboarding datasource and plots
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owners, relevant_assignments))
+    owner_onboarding = load_owner_onboarding(current_country)
+    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owner_onboarding))
     
     var_list = ['is_successful', 'confirmation_rate']
     title_list = ['New Owner Success', 'New Owner Confirmation Rate']
@@ -609,12 +799,9 @@ def new_owner_activity():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
     # Create owner onboarding datasource and plots
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owners, relevant_assignments))
+    owner_onboarding = load_owner_onboarding(current_country)
+    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owner_onboarding))
     
     var_list = ['nb_assignments', 'percent_inactive']
     title_list = ['New Owner Assignments', 'New Owner Inactivity']
@@ -645,12 +832,9 @@ def new_owner_volume():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
     # Create owner onboarding datasource and plots
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owners, relevant_assignments))
+    owner_onboarding = load_owner_onboarding(current_country)
+    owner_onboarding_source = ColumnDataSource(data=create_owner_onboarding_source(owner_onboarding))
     
     var_list = ['nb_owners']
     title_list = ['New Owners']
@@ -681,15 +865,8 @@ def active_sitter_success():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
-    #Get asgnmts
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-
     # Create rolling datasource and plots
-    nh_applications, nh_assignments, nh_index = manipulate_full_data(asgnmts, apps)
-    rolling_data = calculate_rolling(nh_applications, nh_assignments, nh_index)
+    rolling_data = load_rolling(current_country)
     rolling_data_source = ColumnDataSource(data=create_rolling_data_source(rolling_data))
     
     var_list = ['sitter_success', 'sits_per_sitter']
@@ -718,15 +895,8 @@ def active_owner_success():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
-    #Get asgnmts
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-
     # Create rolling datasource and plots
-    nh_applications, nh_assignments, nh_index = manipulate_full_data(asgnmts, apps)
-    rolling_data = calculate_rolling(nh_applications, nh_assignments, nh_index)
+    rolling_data = load_rolling(current_country)
     rolling_data_source = ColumnDataSource(data=create_rolling_data_source(rolling_data))
     
     var_list = ['owner_success', 'confirmation_rate']
@@ -755,15 +925,8 @@ def active_member_ratio():
     if current_country == None:
         current_country = "All"
 
-    # get apps data
-    apps, onboarding_sitters = manipulate_sitters_apps(current_country)
-
-    #Get asgnmts
-    asgnmts, relevant_assignments, owners = manipulate_owner_assignments(apps, current_country)
-
     # Create rolling datasource and plots
-    nh_applications, nh_assignments, nh_index = manipulate_full_data(asgnmts, apps)
-    rolling_data = calculate_rolling(nh_applications, nh_assignments, nh_index)
+    rolling_data = load_rolling(current_country)
     rolling_data_source = ColumnDataSource(data=create_rolling_data_source(rolling_data))
 
     var_list = ['member_ratio']
@@ -0,0 +1,315 @@
+"""Load test the dashboard routes against a locally started server.
+
+Generates synthetic data files, starts gunicorn on them and drives the
+authenticated routes at each concurrency level with a mix of countries.
+Reports throughput, p50/p95/p99 latency per route and per-worker RSS, and
+saves the results as JSON so runs across code versions can be compared.
+
+    python benchmarks/loadtest.py --members 20000 --concurrency 1 4 16 --duration 30
+"""
+import argparse
+import base64
+import csv
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+ROUTES = [
+    '/membership-growth',
+    '/membership-ratio',
+    '/new-sitter-success',
+    '/new-sitter-activity',
+    '/new-sitter-volume',
+    '/new-sitter-verif',
+    '/new-owner-success',
+    '/new-owner-activity',
+    '/new-owner-volume',
+    '/active-sitter-success',
+    '/active-owner-success',
+    '/active-member-ratio',
+]
+
+# Roughly how often each country filter gets picked
+COUNTRY_WEIGHTS = [
+    ('All', 40),
+    ('United Kingdom', 20),
+    ('United States', 15),
+    ('Australia', 10),
+    ('Canada', 5),
+    ('New Zealand', 5),
+    ('ROW', 5),
+]
+BILLING_COUNTRIES = ['United Kingdom', 'United States', 'Australia', 'Canada', 'New Zealand', 'France', 'Germany', 'Spain']
+
+USER = 'loadtest'
+PASSWORD = 'loadtest'
+
+
+## Synthetic data ##
+
+def random_date(rng, start, end):
+    return start + datetime.timedelta(seconds=rng.randint(0, int((end - start).total_seconds())))
+
+def write_csv(path, header, rows):
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def generate_data(data_dir, members, seed):
+    rng = random.Random(seed)
+    start, end = datetime.datetime(2015, 1, 1), datetime.datetime(2018, 2, 28)
+    fmt = '%Y-%m-%d %H:%M:%S'
+
+    def member_rows(first_id):
+        rows = []
+        for user_id in range(first_id, first_id + members):
+            joined = random_date(rng, start, end)
+            rows.append((user_id, joined, joined + datetime.timedelta(days=365), rng.choice(BILLING_COUNTRIES)))
+        return rows
+
+    sitters = member_rows(1)
+    owners = member_rows(members + 1)
+
+    write_csv(os.path.join(data_dir, '180301-sitters.csv'),
+        ['user_id', 'fst_start_date', 'start_date', 'expires_date', 'billing_country'],
+        [(u, d.strftime(fmt), d.strftime(fmt), e.strftime(fmt), c) for u, d, e, c in sitters])
+    write_csv(os.path.join(data_dir, '180301-owners.csv'),
+        ['user_id', 'joined_date', 'fst_start_date', 'start_date', 'expires_date', 'published_date', 'billing_country'],
+        [(u, d.strftime(fmt), d.strftime(fmt), d.strftime(fmt), e.strftime(fmt), d.strftime(fmt), c) for u, d, e, c in owners])
+    write_csv(os.path.join(data_dir, '180313-standard-verif.csv'),
+        ['user_id', 'standard_verif'],
+        [(u, (d + datetime.timedelta(days=rng.randint(0, 60))).strftime(fmt)) for u, d, e, c in sitters if rng.random() < 0.6])
+
+    # Each owner lists a couple of assignments, each gets a handful of applications
+    assignments, applications = [], []
+    for owner_id, joined, expires, country in owners:
+        for n in range(rng.randint(0, 3)):
+            aid = len(assignments) + 1
+            created = random_date(rng, joined, expires)
+            applicants = rng.sample(sitters, rng.randint(0, 6))
+            confirmed = applicants[0][0] if applicants and rng.random() < 0.5 else ''
+            assignments.append((aid, owner_id, confirmed, confirmed, created.strftime(fmt),
+                (created + datetime.timedelta(days=30)).strftime(fmt), (created + datetime.timedelta(days=40)).strftime(fmt)))
+
+            for sitter_id, sitter_joined, e, c in applicants:
+                applied = created + datetime.timedelta(hours=rng.randint(1, 240))
+                is_confirmed = int(sitter_id == confirmed)
+                applications.append((len(applications) + 1, aid, sitter_id, applied.strftime(fmt), applied.strftime(fmt),
+                    is_confirmed, is_confirmed, 'apply'))
+
+    write_csv(os.path.join(data_dir, '180301-assignments.csv'),
+        ['aid', 'ouser_id', 'suser_id', 'sid', 'created_date', 'start_date', 'end_date'], assignments)
+    write_csv(os.path.join(data_dir, '180301-applications.csv'),
+        ['request_id', 'assignment_id', 'suser_id', 'date_created', 'last_modified', 'oconfirmed', 'sconfirmed', 'req_type'], applications)
+
+    num_active = []
+    for period in range(38):
+        month = datetime.date(2015 + (period // 12), period % 12 + 1, 1)
+        for country in BILLING_COUNTRIES:
+            for membership_type in ['homeowner', 'housesitter', 'combined']:
+                num_active.append((month.isoformat(), country, membership_type, rng.randint(members // 100, members // 10 + 1)))
+    write_csv(os.path.join(data_dir, '180301-num-active.csv'), ['period', 'country', 'membership_type', 'num_active'], num_active)
+
+
+## Server ##
+
+def server_settings(work_dir, backend, precompute_countries):
+    # Everything the app writes goes under work_dir, so runs never touch the checkout or each other
+    return {
+        'DATA_BACKEND': backend,
+        'DATABASE_PATH': os.path.join(work_dir, 'dashboard.sqlite'),
+        'CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'PRECOMPUTE_COUNTRIES': precompute_countries,
+    }
+
+def start_server(work_dir, port, workers, settings):
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), GLOBALUSER=USER, GLOBALPASS=PASSWORD)
+    env.update(settings)
+    # The pinned gunicorn has no __main__ module, so start its console script entry point directly
+    return subprocess.Popen(
+        [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--pythonpath', ROOT, 'bkdash:app'],
+        cwd=work_dir, env=env)
+
+def wait_for_server(server, base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        # A server that failed to boot, or whose warm up raised, won't come back
+        if server.poll() is not None:
+            raise RuntimeError('server exited with code {0} before it started'.format(server.returncode))
+        try:
+            urlopen(base_url + '/bokeh-static/missing/js/bokeh.min.js', timeout=5)
+            return
+        except HTTPError:
+            return
+        except (URLError, IOError):
+            time.sleep(0.5)
+    raise RuntimeError('server did not start within {0}s'.format(timeout))
+
+def worker_rss(master_pid):
+    # Resident set size in kB of each gunicorn worker, read from /proc (Linux only)
+    rss = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/status'.format(pid)) as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except IOError:
+            continue
+        if int(status['PPid'].strip()) == master_pid:
+            rss[int(pid)] = int(status['VmRSS'].split()[0])
+    return rss
+
+
+## Load ##
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    # Nearest rank
+    return values[max(0, int(math.ceil(pct / 100.0 * len(values))) - 1)]
+
+def summarise(latencies):
+    return {
+        'requests': len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+    }
+
+def run_level(base_url, concurrency, duration, seed):
+    countries = [country for country, weight in COUNTRY_WEIGHTS for n in range(weight)]
+    credentials = '{0}:{1}'.format(USER, PASSWORD).encode('utf-8')
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii'), 'Accept-Encoding': 'gzip'}
+
+    results = []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def user(n):
+        rng = random.Random(seed + n)
+        while time.time() < deadline:
+            route = rng.choice(ROUTES)
+            url = '{0}{1}?country={2}'.format(base_url, route, rng.choice(countries).replace(' ', '+'))
+            started = time.time()
+            try:
+                response = urlopen(Request(url, headers=headers), timeout=300)
+                response.read()
+                status = response.getcode()
+            except HTTPError as e:
+                status = e.code
+            except (URLError, IOError):
+                status = None
+            with lock:
+                results.append((route, status, time.time() - started))
+
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(concurrency)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    ok = [r for r in results if r[1] == 200]
+    return {
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'throughput': len(ok) / elapsed,
+        'errors': len(results) - len(ok),
+        'overall': summarise([r[2] for r in ok]),
+        'routes': dict((route, summarise([r[2] for r in ok if r[0] == route])) for route in ROUTES),
+    }
+
+def print_level(level):
+    print('')
+    print('concurrency {concurrency}: {throughput:.2f} req/s, {errors} errors'.format(**level))
+    print('  {0:<24} {1:>8} {2:>8} {3:>8} {4:>8}'.format('route', 'requests', 'p50', 'p95', 'p99'))
+    for route in ['overall'] + ROUTES:
+        stats = level['overall'] if route == 'overall' else level['routes'][route]
+        cells = ['{0:.3f}'.format(stats[p]) if stats[p] is not None else '-' for p in ['p50', 'p95', 'p99']]
+        print('  {0:<24} {1:>8} {2:>8} {3:>8} {4:>8}'.format(route, stats['requests'], *cells))
+    print('  worker RSS (MB): ' + ', '.join('{0:.0f}'.format(kb / 1024.0) for kb in level['worker_rss_kb'].values()))
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000, help='synthetic sitters and owners to generate, each')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run each concurrency level')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['pandas', 'sqlite'], default='pandas')
+    parser.add_argument('--precompute-countries', default='All', help='comma separated, computed at boot')
+    parser.add_argument('--output', help='results file, defaults to benchmarks/results/<revision>-<time>.json')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='loadtest-')
+    data_dir = os.path.join(work_dir, 'app', 'data_files')
+    os.makedirs(data_dir)
+    generate_data(data_dir, args.members, args.seed)
+
+    base_url = 'http://127.0.0.1:{0}'.format(args.port)
+    settings = server_settings(work_dir, args.backend, args.precompute_countries)
+    server = start_server(work_dir, args.port, args.workers, settings)
+    try:
+        wait_for_server(server, base_url, timeout=600)
+
+        levels = []
+        for concurrency in args.concurrency:
+            level = run_level(base_url, concurrency, args.duration, args.seed)
+            level['worker_rss_kb'] = worker_rss(server.pid)
+            print_level(level)
+            levels.append(level)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+        shutil.rmtree(work_dir)
+
+    revision = git_revision()
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+        '{0}-{1}.json'.format(revision, datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+
+    with open(output, 'w') as f:
+        json.dump({
+            'revision': revision,
+            'members': args.members,
+            'workers': args.workers,
+            'duration': args.duration,
+            'seed': args.seed,
+            'settings': settings,
+            'levels': levels,
+        }, f, indent=2, sort_keys=True)
+    print('')
+    print('saved ' + output)
+
+
+if __name__ == '__main__':
+    main()
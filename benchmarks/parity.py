@@ -0,0 +1,127 @@
+"""Check the SQLite backend and the pruned pandas plans against the original pandas pipeline.
+
+Generates synthetic data files, then for every country computes each
+monthly series three ways: the original pandas pipeline reading whole
+files, the pandas pipeline with its query plan, and the SQLite backend.
+Exits non-zero if any column or month differs from the original.
+
+    python benchmarks/parity.py --members 1000 --seed 0
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from loadtest import generate_data
+
+# Relative tolerance for float columns, SQLite sums and averages in a different order
+RTOL = 1e-9
+
+
+## Original pandas pipeline, whole files and no plan ##
+
+def original_sitter_onboarding(routes, country):
+    apps, onboarding_sitters = routes.manipulate_sitters_apps(country)
+    return routes.sample_sitter_onboarding(onboarding_sitters)
+
+def original_sitter_verif(routes, country):
+    apps, onboarding_sitters = routes.manipulate_sitters_apps(country)
+    return routes.sample_sitter_verif(routes.manipulate_sitter_verif(onboarding_sitters))
+
+def original_owner_onboarding(routes, country):
+    apps, onboarding_sitters = routes.manipulate_sitters_apps(country)
+    asgnmts, relevant_assignments, owners = routes.manipulate_owner_assignments(apps, country)
+    return routes.sample_owner_onboarding(owners, relevant_assignments)
+
+def original_rolling(routes, country):
+    apps, onboarding_sitters = routes.manipulate_sitters_apps(country)
+    asgnmts, relevant_assignments, owners = routes.manipulate_owner_assignments(apps, country)
+    nh_applications, nh_assignments, nh_index = routes.manipulate_full_data(asgnmts, apps)
+    return routes.calculate_rolling(nh_applications, nh_assignments, nh_index)
+
+
+## Comparison ##
+
+def compare(expected, actual):
+    import numpy as np
+
+    problems = []
+    if len(expected.index) != len(actual.index) or not (expected.index == actual.index).all():
+        problems.append('months differ: {0} vs {1}'.format(len(expected.index), len(actual.index)))
+        return problems
+
+    for name in expected.columns:
+        if name not in actual.columns:
+            problems.append('{0} missing'.format(name))
+            continue
+        want = expected[name].values.astype(float)
+        got = actual[name].values.astype(float)
+        if not np.allclose(want, got, rtol=RTOL, atol=0, equal_nan=True):
+            rows = np.flatnonzero(~np.isclose(want, got, rtol=RTOL, atol=0, equal_nan=True))
+            problems.append('{0} differs in {1} months, first {2}: {3!r} vs {4!r}'.format(
+                name, len(rows), expected.index[rows[0]].date(), want[rows[0]], got[rows[0]]))
+
+    return problems
+
+def check(routes, app, countries):
+    loaders = [
+        (routes.load_sitter_onboarding, original_sitter_onboarding),
+        (routes.load_sitter_verif, original_sitter_verif),
+        (routes.load_owner_onboarding, original_owner_onboarding),
+        (routes.load_rolling, original_rolling),
+    ]
+
+    failures = 0
+    for loader, original in loaders:
+        for country in countries:
+            expected = original(routes, country)
+            for backend in ['pandas', 'sqlite']:
+                app.config['DATA_BACKEND'] = backend
+                problems = compare(expected, loader.compute(country))
+                label = '{0:<24} {1:<16} {2:<7}'.format(loader.__name__, country, backend)
+                print(label + (' ok' if not problems else ' FAIL'))
+                for problem in problems:
+                    print('    ' + problem)
+                failures += bool(problems)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=1000, help='synthetic sitters and owners to generate, each')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='parity-')
+    data_dir = os.path.join(work_dir, 'app', 'data_files')
+    os.makedirs(data_dir)
+    generate_data(data_dir, args.members, args.seed)
+
+    # The data file paths are relative to the working directory, the database goes with them and nothing is cached
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(work_dir, 'dashboard.sqlite'),
+        'CACHE_DIR': '',
+        'GLOBALUSER': 'parity',
+        'GLOBALPASS': 'parity',
+    })
+    os.chdir(work_dir)
+    sys.path.insert(0, ROOT)
+    try:
+        from app import app, routes
+        failures = check(routes, app, routes.COUNTRY_OPTIONS)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir)
+
+    print('')
+    print('{0} mismatches'.format(failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measure cold import and first request time for the dashboard.
+
+Each run starts a fresh interpreter, imports the app and serves / once.
+Exits non-zero if the median time goes over the budget, if importing the
+app pulled in the analytics and plotting libraries, or if / did not
+return 200. GLOBALUSER and GLOBALPASS must be set (or in .env).
+
+    python benchmarks/startup.py --runs 5 --budget 1.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Must not be imported until a route needs them
+HEAVY_MODULES = ['pandas', 'numpy', 'bokeh', 'dateutil']
+
+BOOT_SCRIPT = """
+import base64, json, sys, time
+start = time.time()
+from app import app
+import settings
+imported = time.time()
+heavy_modules = sorted(m for m in %r if m in sys.modules)
+
+credentials = '{0}:{1}'.format(settings.GLOBALUSER, settings.GLOBALPASS).encode('utf-8')
+headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')}
+response = app.test_client().get('/', headers=headers)
+served = time.time()
+
+print(json.dumps({
+    'import': imported - start,
+    'first_request': served - imported,
+    'status': response.status_code,
+    'heavy_modules': heavy_modules,
+}))
+""" % HEAVY_MODULES
+
+
+def boot_once():
+    output = subprocess.check_output([sys.executable, '-c', BOOT_SCRIPT], cwd=ROOT)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.5, help='seconds allowed for import plus first request')
+    args = parser.parse_args()
+
+    results = [boot_once() for run in range(args.runs)]
+    boot_times = [r['import'] + r['first_request'] for r in results]
+
+    print('import         median {0:.3f}s'.format(median([r['import'] for r in results])))
+    print('first request  median {0:.3f}s (status {1})'.format(median([r['first_request'] for r in results]), results[-1]['status']))
+    print('boot           median {0:.3f}s, budget {1:.3f}s'.format(median(boot_times), args.budget))
+
+    failed = False
+    if median(boot_times) > args.budget:
+        print('FAIL: startup is over budget')
+        failed = True
+
+    heavy_modules = sorted(set(m for r in results for m in r['heavy_modules']))
+    if heavy_modules:
+        print('FAIL: imported at startup: ' + ', '.join(heavy_modules))
+        failed = True
+
+    statuses = sorted(set(r['status'] for r in results))
+    if statuses != [200]:
+        print('FAIL: / returned {0}, check GLOBALUSER and GLOBALPASS'.format(', '.join(str(s) for s in statuses)))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,26 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config(object):
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
\ No newline at end of file
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
+
+    # 'pandas' works straight from the CSVs, 'sqlite' queries an embedded database built from them
+    DATA_BACKEND = os.environ.get('DATA_BACKEND') or 'pandas'
+    DATABASE_PATH = os.environ.get('DATABASE_PATH') or os.path.join(basedir, 'app', 'data_files', 'dashboard.sqlite')
+
+    # Countries whose series are computed at boot when the server preloads the app
+    PRECOMPUTE_COUNTRIES = (os.environ.get('PRECOMPUTE_COUNTRIES') or 'All').split(',')
+
+    # How often the live Bokeh server dashboard checks the data files for new months
+    LIVE_REFRESH_SECONDS = int(os.environ.get('LIVE_REFRESH_SECONDS') or 600)
+
+    # Derived frames are kept here across restarts, set CACHE_DIR to an empty string to disable
+    CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(basedir, 'cache'))
+    CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES') or 1024 ** 3)
+
+    # Response compression, brotli is used when the optional brotli package is installed
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_BR_QUALITY = 5
+
+    # Local Bokeh assets are fingerprinted so can be cached for a year
+    BOKEH_ASSET_MAX_AGE = 31536000
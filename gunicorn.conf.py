@@ -0,0 +1,14 @@
+import os
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Load the app in the master so workers fork with it already imported
+preload_app = True
+
+def when_ready(server):
+    # Runs in the master before any worker is forked, the imports and series are shared copy-on-write
+    from app import app
+    from app.routes import warm_up
+
+    warm_up(app.config['PRECOMPUTE_COUNTRIES'])
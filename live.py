@@ -0,0 +1,12 @@
+"""Live version of the growth and network health dashboards, run with:
+
+    bokeh serve live.py
+
+Country changes patch the plotted sources in place, and new months are
+streamed to open browsers once the data files are updated.
+"""
+from bokeh.io import curdoc
+
+from app.live import build_document
+
+build_document(curdoc())